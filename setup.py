@@ -5,9 +5,15 @@ from setuptools import setup
 with open('README.md', 'r', encoding='utf-8') as f:
     long_description = f.read()
 
-with open('requirements.txt', 'r', encoding='utf-8') as f:
-    content = f.readlines()
-    requirements = [x.strip() for x in content]
+# Keep in sync with requirements.txt
+requirements = [
+    'simple_term_menu',
+    'colorama',
+    'argparse',
+    'console-menu',
+    'psutil',
+    'pyperclip',
+]
 
 shutil.copyfile('uberfile.py', 'uberfile')
 
@@ -26,7 +32,7 @@ setup(
         'Programming Language :: Python :: 3',
         'Topic :: Security',
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     install_requires=requirements,
     scripts=['uberfile']
 )
